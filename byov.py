@@ -5,21 +5,51 @@
 # Distributed under the MIT License - see LICENSE file for details
 
 import argparse
-import random
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 import kagglehub
+import numpy as np
 import pandas as pd
 import weaviate
 import weaviate.classes as wvc
 from weaviate.classes.query import MetadataQuery
 
+# Numba is optional, if it is installed it is used to speed up numeric work on large datasets
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Numexpr is optional, if it is installed it is used to evaluate array expressions in a single multi-threaded pass
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
 # Constants
 SCRIPT_DESCRIPTION = "Demonstrator project:  Bring-your-own vector store and seach;  Load Kaggle CSV numeric dataset into Weaviate with self-generated vectors and query with nearest vector search"
 
+log = logging.getLogger("byov")
+
+# Random number generator shared by all random sampling in the script
+RNG = np.random.default_rng()
+
 # Default values
 KAGGLE_DATASET = "atharvaingle/crop-recommendation-dataset"
 KAGGLE_DATA_FILE = "Crop_recommendation.csv"
 DATASET_LABEL_COLUMN = "label"
 WEAVIATE_COLLECTION = "CropRecommendations"
+WEAVIATE_HTTP_PORT = 8080
+WEAVIATE_GRPC_PORT = 50051
+WEAVIATE_BATCH_SIZE = 500
+WEAVIATE_HNSW_EF_CONSTRUCTION = 64  # Weaviate default is 128
+WEAVIATE_HNSW_MAX_CONNECTIONS = 16  # Weaviate default is 32
+WEAVIATE_QUERY_WORKERS = 8
+VERIFY_SAMPLE_SIZE = 64
+NORMALIZE_VECTORS = False
+NUMBA_MIN_ROWS = 1_000_000  # Use Numba (if installed) for datasets with at least this many rows
 
 # The default dataset contains sensor readings for soil and environmental conditions
 # and a recommended crop to grow based on these conditions, see
@@ -42,10 +72,19 @@ label - the recommended crop to grow
 
 
 
+def positive_int(value):
+    # Argument type for command line options that must be a whole number greater than zero
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than zero, got {value}")
+
+    return number
+
+
 def parse_cli_arguments():
     # Parse command line options
     # Display help message if --help flag is specified
-    global KAGGLE_DATASET, KAGGLE_DATA_FILE, DATASET_LABEL_COLUMN, WEAVIATE_COLLECTION
+    global KAGGLE_DATASET, KAGGLE_DATA_FILE, DATASET_LABEL_COLUMN, WEAVIATE_COLLECTION, WEAVIATE_BATCH_SIZE, VERIFY_SAMPLE_SIZE, NORMALIZE_VECTORS
 
     parser = argparse.ArgumentParser(description=SCRIPT_DESCRIPTION)
 
@@ -58,14 +97,26 @@ def parse_cli_arguments():
     parser.add_argument("--dataset-label-column", type=str, default=DATASET_LABEL_COLUMN, help="Column name for label column (default: %(default)s)")
 
     parser.add_argument("--weaviate-collection", type=str, default=WEAVIATE_COLLECTION, help="Weaviate collection name (default: %(default)s)")
+    parser.add_argument("--normalize-vectors", action="store_true", help="Scale each vector value to the range 0 to 1 using the min and max of its column")
+    parser.add_argument("--verbose", action="store_true", help="Output debug messages, including for each vector search")
+    parser.add_argument("--weaviate-batch-size", type=positive_int, default=WEAVIATE_BATCH_SIZE, help="Number of objects sent to Weaviate per insert batch (default: %(default)s)")
+    parser.add_argument("--verify-sample-size", type=positive_int, default=VERIFY_SAMPLE_SIZE, help="Number of known rows searched for in the sanity check (default: %(default)s)")
 
     args = parser.parse_args()
 
+    # Each run normalizes with the value ranges of its own dataset, so vectors appended to a previously
+    # existing collection would not be comparable with the vectors already in it
+    if args.normalize_vectors and args.append_collection:
+        parser.error("--normalize-vectors cannot be used with --append-collection")
+
     # Update default values with command line options (will use default values if not specified))
     KAGGLE_DATASET = args.kaggle_dataset
     KAGGLE_DATA_FILE = args.kaggle_datafile
     DATASET_LABEL_COLUMN = args.dataset_label_column
     WEAVIATE_COLLECTION = args.weaviate_collection
+    WEAVIATE_BATCH_SIZE = args.weaviate_batch_size
+    VERIFY_SAMPLE_SIZE = args.verify_sample_size
+    NORMALIZE_VECTORS = args.normalize_vectors
 
     return args
 
@@ -94,12 +145,46 @@ def download_kaggle_dataset(dataset, path):
     return local_path
 
 
+def downcast_dataframe_integer_columns(df):
+    # Narrow integer columns to the smallest integer type that holds their values
+    # (e.g. int64 to int16), which does not change any of the values
+    # Float columns are left as they are, so the properties stored in Weaviate match the source data
+    # (the vectors are narrowed to float32 separately, see get_dataframe_value_matrix)
+    for column in df.columns:
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+
+    return df
+
+
 def read_csv_to_dataframe(path):
     # Use Pandas to read CSV file into Pandas DataFrame
+    # A Parquet copy of the CSV file is cached alongside it, so later runs can skip parsing the CSV
     print("Read CSV file into pandas DataFrame")
     print(f"CSV file path: {path}")
 
-    df = pd.read_csv(path)
+    parquet_path = path + ".parquet"
+
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        print(f"Read cached Parquet copy of CSV file: {parquet_path}")
+        df = pd.read_parquet(parquet_path, dtype_backend="pyarrow")
+    else:
+        df = pd.read_csv(path, engine="pyarrow", dtype_backend="pyarrow")
+        df = downcast_dataframe_integer_columns(df)
+
+        # The cache is only an optimisation, so carry on without it if it cannot be written
+        # It is written to a temporary file first, so a failed write never leaves a partial cache behind
+        print(f"Cache Parquet copy of CSV file: {parquet_path}")
+        temp_parquet_path = parquet_path + ".tmp"
+        try:
+            df.to_parquet(temp_parquet_path, compression="zstd")
+            os.replace(temp_parquet_path, parquet_path)
+        except (OSError, ValueError, NotImplementedError) as e:
+            # OSError covers file system errors, pyarrow raises ValueError (ArrowInvalid) for data it
+            # cannot write and NotImplementedError if the compression codec is not available
+            print(f"Unable to cache Parquet copy of CSV file, continuing without it: {e}")
+            if os.path.exists(temp_parquet_path):
+                os.remove(temp_parquet_path)
     print("")
 
     # Print summary information about the dataset
@@ -109,22 +194,112 @@ def read_csv_to_dataframe(path):
     return df
 
 
-def get_dataframe_value_column_names_as_list(df, label_column):
-    # Generate a list of the dataframe's column names
-    # Exclude the label column
-    column_names = df.columns.tolist()
-    column_names.remove(label_column)
+def get_dataframe_value_column_names(df, label_column):
+    # Get the dataframe's column names, excluding the label column
+    # These are kept as a Pandas Index (in their original order), which can be used directly to select columns
+    # The label column name comes from the command line, so check it is in the dataset
+    if label_column not in df.columns:
+        raise KeyError(f"Label column {label_column} not found in dataset, columns are: {df.columns.tolist()} (see --dataset-label-column)")
+
+    column_names = df.columns.drop(label_column)
 
     return column_names
 
 
+def get_dataframe_value_matrix(df, value_column_names):
+    # Extract the value columns from the dataframe as a single contiguous float32 NumPy array
+    # (one row per dataset row), this is shared by all of the vector operations so the
+    # dataframe columns only need to be looked up once
+    # The columns are selected by position, looking up all of the column names in one go
+    value_column_positions = df.columns.get_indexer(value_column_names)
+    value_matrix = np.ascontiguousarray(df.iloc[:, value_column_positions].to_numpy(dtype=np.float32))
+
+    return value_matrix
+
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def block_min_max_numba(value_matrix, block_size):
+        # Calculate the min and max of each column for each block of rows, in a single pass
+        # over the rows of each block, with the blocks processed in parallel
+        # Missing values (NaN) are skipped, a block column with no values has NaN min and max
+        row_count, column_count = value_matrix.shape
+        block_count = (row_count + block_size - 1) // block_size
+        block_mins = np.empty((block_count, column_count), dtype=value_matrix.dtype)
+        block_maxs = np.empty((block_count, column_count), dtype=value_matrix.dtype)
+
+        for block in numba.prange(block_count):
+            start = block * block_size
+            end = min(start + block_size, row_count)
+
+            for column in range(column_count):
+                block_mins[block, column] = np.inf
+                block_maxs[block, column] = -np.inf
+
+            for row in range(start, end):
+                for column in range(column_count):
+                    value = value_matrix[row, column]
+                    if np.isnan(value):
+                        continue
+                    if value < block_mins[block, column]:
+                        block_mins[block, column] = value
+                    if value > block_maxs[block, column]:
+                        block_maxs[block, column] = value
+
+            # Min can only be greater than max if no values were found
+            for column in range(column_count):
+                if block_mins[block, column] > block_maxs[block, column]:
+                    block_mins[block, column] = np.nan
+                    block_maxs[block, column] = np.nan
+
+        return block_mins, block_maxs
+
+
+def column_min_max(value_matrix):
+    # Calculate the min and max of each column in the value matrix
+    # Numba is only worth its compilation overhead for large datasets
+    if numba is not None and value_matrix.shape[0] >= NUMBA_MIN_ROWS:
+        # Split the rows into one block per thread, then combine the (few) per-block results with NumPy
+        block_size = -(-value_matrix.shape[0] // numba.get_num_threads())
+        block_mins, block_maxs = block_min_max_numba(value_matrix, block_size)
+        return np.nanmin(block_mins, axis=0), np.nanmax(block_maxs, axis=0)
+
+    # Missing values (NaN) are skipped, as Pandas does when calculating min and max
+    return np.nanmin(value_matrix, axis=0), np.nanmax(value_matrix, axis=0)
+
+
+def normalize_value_matrix(value_matrix, mins, maxs):
+    # Scale the values in each column to the range 0 to 1, using the given min and max for each column,
+    # so that every column contributes on the same scale to the vector distance
+    # Columns with a single value (max equal to min) are scaled to 0
+    # Missing values stay missing, only in their own row - the ranges skip missing values
+    # (see column_min_max), and a column with no values at all is left unscaled rather than
+    # using its missing (NaN) range
+    mins = np.where(np.isnan(mins), 0, mins).astype(value_matrix.dtype)
+    value_spans = np.where(maxs > mins, maxs - mins, 1).astype(value_matrix.dtype)
+
+    if numexpr is not None:
+        return numexpr.evaluate("(values - mins) / spans", local_dict={"values": value_matrix, "mins": mins, "spans": value_spans})
+
+    return (value_matrix - mins) / value_spans
+
+
 def weaviate_connect():
     # Create a Weaviate client instance
     # Weaviate must be running locally
 
-    print("Weaviate must be running locally")
-    print("Connect to Weaviate")
-    weaviate_client = weaviate.connect_to_local()
+    # The v4 client sends inserts and queries over gRPC, which has lower per-request overhead than REST
+    # Weaviate's gRPC port must be reachable, as well as its HTTP port
+    # Timeouts are raised from the defaults so that large batch inserts are not cut short
+    # This does not print anything, as it runs in the background alongside the dataset download
+    # (the connection messages are printed in step 7)
+    weaviate_client = weaviate.connect_to_local(
+        port=WEAVIATE_HTTP_PORT,
+        grpc_port=WEAVIATE_GRPC_PORT,
+        additional_config=wvc.init.AdditionalConfig(
+            timeout=wvc.init.Timeout(init=30, query=60, insert=300)
+        )
+    )
 
     return weaviate_client
 
@@ -135,6 +310,13 @@ def weaviate_close_client(weaviate_client):
     weaviate_client.close()
 
 
+def weaviate_close_client_when_connected(weaviate_connect_future):
+    # Close a Weaviate client that is connecting in the background, once it has connected
+    # There is nothing to close if the connection failed
+    if weaviate_connect_future.exception() is None:
+        weaviate_close_client(weaviate_connect_future.result())
+
+
 def weaviate_collection_exists(weaviate_client, collection_name):
     # Check if Weaviate collection exists
     print(f"Check if Weaviate collection {collection_name} exists")
@@ -155,10 +337,19 @@ def weaviate_create_collection(weaviate_client, collection_name):
     # We are not using a vectoriser, so we specify none
     # The properties will be the column names and values from the dataset
     # The vector will be the values from the columns in the dataset
+    # The HNSW vector index is built as objects are inserted, so it is configured with a smaller
+    # construction search size and fewer connections per node than Weaviate's defaults, which makes
+    # bulk loading much faster at a small cost in search accuracy
+    # (Weaviate does not allow these to be changed once the collection has been created)
     print(f"Create Weaviate collection {collection_name}")
     weaviate_client.collections.create(
         name=collection_name,
-        vectorizer_config=wvc.config.Configure.Vectorizer.none()
+        vectorizer_config=wvc.config.Configure.Vectorizer.none(),
+        vector_index_config=wvc.config.Configure.VectorIndex.hnsw(
+            distance_metric=wvc.config.VectorDistances.COSINE,
+            ef_construction=WEAVIATE_HNSW_EF_CONSTRUCTION,
+            max_connections=WEAVIATE_HNSW_MAX_CONNECTIONS
+        )
     )
 
 
@@ -170,35 +361,45 @@ def weaviate_get_collection(weaviate_client, collection_name):
     return collection
 
 
-def make_vector_from_dataframe_row(row, value_column_names):
+def make_vector_from_dataframe_row(value_matrix, row_num):
     # Make a vector with values from a row taken from the source dataset
     # The vector will be the values from the columns in the dataset, excluding the label column
-    vector = [row[column] for column in value_column_names]
+    vector = value_matrix[row_num].tolist()
 
     return vector
 
 
-def weaviate_insert_dataframe(collection, df, value_column_names):
-    # Loop over the pandas dataframe and add all rows to Weaviate
-    # Because we are specifiyng our own vector, we must create a
-    # weaviate.classes.data.DataObject object instance for each row, this enables us to
-    # specify the row properties and also the vector value itself
+def weaviate_insert_dataframe(weaviate_client, collection_name, df, value_matrix, batch_size):
+    # Add all rows of the pandas dataframe to Weaviate
+    # Because we are specifiyng our own vector, we add each row as an object with its
+    # properties and also the vector value itself
+    # Objects are streamed to Weaviate in fixed size batches, so that network requests overlap
+    # with generating the objects and we never hold a copy of the whole dataset as objects
 
     print("Insert Pandas dataframe into Weaviate collection")
-    print("Generate Weaviate DataObject instances for each row in the dataset")
-    row_objs = list()
-    for index, row in df.iterrows():    # index is the row number but unused for our purposes
-        # Using the column names for the dataset, create a list of values for the vector
-        vector = make_vector_from_dataframe_row(row, value_column_names)
-
-        # Create a DataObject instance for the row
-        row_objs.append(wvc.data.DataObject(
-            properties=row,
-            vector=vector
-        ))
-
-    print("Insert all DataObject instances into Weaviate")
-    collection.data.insert_many(row_objs)
+    print(f"Add an object for each row in the dataset, in batches of {batch_size}")
+
+    # The rows are converted one batch at a time: the properties to plain dicts and the vectors
+    # to plain lists, each in a single bulk conversion (numpy values to Python values) for the batch,
+    # rather than row by row, while never holding all rows as dicts at once
+    with weaviate_client.batch.fixed_size(batch_size=batch_size) as batch:
+        for start in range(0, len(df), batch_size):
+            end = start + batch_size
+            records = df.iloc[start:end].to_dict(orient="records")
+            vectors = value_matrix[start:end].tolist()
+
+            for record, vector in zip(records, vectors):
+                batch.add_object(
+                    collection=collection_name,
+                    properties=record,
+                    vector=vector
+                )
+
+    failed_objects = weaviate_client.batch.failed_objects
+    if failed_objects:
+        print(f"Number of objects that failed to insert into Weaviate: {len(failed_objects)}")
+        print(f"First failed object error: {failed_objects[0].message}")
+
     print("Dataframe inserted into Weaviate\n")
 
 
@@ -219,8 +420,9 @@ def count_dataframe_items(df):
 
 
 def weaviate_query_nearest_vector(collection, vector, limit=1):
-    print("Query Weaviate collection with nearest vector search")
-    print(f"Search vector:\n{vector}")
+    # Called once per search, so only log (at debug level) rather than print
+    log.debug("Query Weaviate collection with nearest vector search")
+    log.debug("Search vector:\n%s", vector)
     response = collection.query.near_vector(
         near_vector=vector,
         limit=limit,
@@ -230,15 +432,18 @@ def weaviate_query_nearest_vector(collection, vector, limit=1):
     return response
 
 
-def get_random_vector_label_pair_from_dataframe(df, value_column_names, label_column):
-    # Choose a random row from the dataframe
-    row_num = random.randint(0, dataset_row_count - 1)
-    row = df.iloc[row_num]
+def get_random_vector_label_pairs_from_dataframe(df, value_matrix, label_column, sample_size):
+    # Choose a sample of random rows from the dataframe (without repeats)
+    # Index directly into NumPy arrays of the values and labels, avoiding creating a Pandas Series for each row
+    labels = df[label_column].to_numpy()
 
-    vector = make_vector_from_dataframe_row(row, value_column_names)
-    label = row[label_column]
+    sample_size = min(sample_size, value_matrix.shape[0])
+    row_nums = RNG.choice(value_matrix.shape[0], size=sample_size, replace=False)
 
-    return vector, label
+    vectors = [make_vector_from_dataframe_row(value_matrix, row_num) for row_num in row_nums]
+    sample_labels = labels[row_nums].tolist()
+
+    return vectors, sample_labels
 
 
 def perform_vector_search(collection, vector, label_column):
@@ -246,7 +451,7 @@ def perform_vector_search(collection, vector, label_column):
     response = weaviate_query_nearest_vector(collection, vector)
 
     # Get first result, result set is limited to 1 object
-    print("Get first result from response from Weaviate")
+    log.debug("Get first result from response from Weaviate")
     reponse_obj = response.objects[0]
 
     row = reponse_obj.properties
@@ -256,47 +461,63 @@ def perform_vector_search(collection, vector, label_column):
     return row, label, vector_distance
 
 
-def verify_vector_search_label_matches(collection, vector, label, label_column):
-    # Query Weaviate with nearest vector search for a known vector and its associated label
-    row, obtained_label, vector_distance = perform_vector_search(collection, vector, label_column)    
+def weaviate_query_nearest_vector_labels(collection, vectors, label_column):
+    # Query Weaviate with nearest vector search for each of a list of vectors, returning the label
+    # of the nearest object for each (None if nothing was found)
+    # The queries are sent concurrently, so the total time is close to that of a single query
+    def query_label(vector):
+        response = weaviate_query_nearest_vector(collection, vector)
+        if not response.objects:
+            return None
+        return response.objects[0].properties[label_column]
 
-    print(f"Expected label: {label}")
-    print(f"Label obtained from Weaviate search: {obtained_label}")
+    with ThreadPoolExecutor(max_workers=WEAVIATE_QUERY_WORKERS) as executor:
+        obtained_labels = list(executor.map(query_label, vectors))
 
-    print(f"Vector distance of search vector to matched vector: {vector_distance}")
+    return obtained_labels
 
-    if label == obtained_label:
-        print("Expected label matches label obtained from Weaviate search")
-        return True
-    else:
-        print("Expected label does not match label obtained from Weaviate search")
-        return False
-    print("")
 
+def verify_vector_search_labels_batch(collection, vectors, labels, label_column):
+    # Query Weaviate with nearest vector search for a sample of known vectors and their associated labels
+    # Report the fraction of searches where the nearest object has the expected label (recall@1)
+    obtained_labels = weaviate_query_nearest_vector_labels(collection, vectors, label_column)
 
-def get_dataframe_column_ranges(df, value_column_names):
-    # Calculate the range of values for each column, excluding the label column
-    print("Calculate value ranges for each column in the dataset")
-    
-    # Make a list of vaule column names and the associated min and max values
-    value_ranges = {column: {"min": df[column].min(), "max": df[column].max()} for column in value_column_names}
+    match_count = sum(1 for label, obtained_label in zip(labels, obtained_labels) if label == obtained_label)
+    recall = match_count / len(labels) if labels else 0.0
+
+    print(f"Number of sample rows searched: {len(labels)}")
+    print(f"Number of sample rows where expected label matches label obtained from Weaviate search: {match_count}")
+    print(f"Recall@1: {recall:.3f}")
 
-    print(f"Value ranges: \n{value_ranges}\n")
+    if match_count == len(labels):
+        print("Expected labels match labels obtained from Weaviate search for all sample rows")
+    else:
+        print("Expected labels do not match labels obtained from Weaviate search for all sample rows")
 
-    return value_ranges
+    return recall
 
 
-def generate_random_vector_from_property_ranges(value_ranges):
-    # Generate a random vector from the range of values for each column
+def generate_random_vector_from_value_ranges(df, value_column_names, mins, maxs):
+    # Generate a random vector from the range of values for each column, excluding the label column
+    # The ranges are NumPy arrays (see column_min_max), passed straight to the random number generator
     # Respect the variable type of each column
+    print("Value ranges:")
+    for column, min_value, max_value in zip(value_column_names, mins, maxs):
+        print(f"{column}: min {min_value}, max {max_value}")
+    print("")
+
     print("Generate a random vector using the value ranges for each column")
 
-    random_vector = [
-        random.randint(value_ranges[column]["min"], value_ranges[column]["max"]) if df[column].dtype == int 
-        else random.uniform(value_ranges[column]["min"], value_ranges[column]["max"]) if df[column].dtype == float 
-        else random.choice(df[column].unique()) 
-        for column in value_ranges
-    ]
+    # Identify the integer columns, all other value columns are treated as floats
+    value_column_dtypes = df.dtypes[value_column_names]
+    is_int = np.array([pd.api.types.is_integer_dtype(dtype) for dtype in value_column_dtypes], dtype=bool)
+
+    # Generate values for all columns in one call, then overwrite the integer columns
+    # with whole numbers (inclusive of the max value)
+    random_values = RNG.uniform(mins, maxs)
+    random_values[is_int] = RNG.integers(mins[is_int].astype(np.int64), maxs[is_int].astype(np.int64), endpoint=True)
+
+    random_vector = random_values.tolist()
 
     print(f"Random vector: \n{random_vector}\n")
 
@@ -308,6 +529,14 @@ def generate_random_vector_from_property_ranges(value_ranges):
 print("Step 1. Parse command line options")
 # Parse command line options - will display help message and exit if help flag specified
 args = parse_cli_arguments()
+
+# Debug messages are only output if the verbose flag is specified
+# Only this script's logger is configured, logging from other libraries is left at its defaults
+log_handler = logging.StreamHandler(sys.stdout)
+log_handler.setFormatter(logging.Formatter("%(message)s"))
+log.addHandler(log_handler)
+log.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+log.propagate = False
 print("")
 
 
@@ -330,32 +559,63 @@ print(f"Append to Weaviate collection flag set: {append_collection}")
 print("")
 
 
-print("Step 4. Download the dataset from Kaggle")
-# Download the Kaggle dataset
-path = download_kaggle_dataset(KAGGLE_DATASET, KAGGLE_DATA_FILE)
-print("")
+print("Step 4. Download the dataset from Kaggle - connect to Weaviate (step 7) at the same time, as they are independent")
+# Start connecting the Weaviate client in the background, the client is picked up in step 7
+connect_executor = ThreadPoolExecutor(max_workers=1)
+weaviate_connect_future = connect_executor.submit(weaviate_connect)
+connect_executor.shutdown(wait=False)
 
+# Any error in the dataset steps stops the script, but the Weaviate client
+# connecting in the background must still be closed first
+try:
+    # Download the Kaggle dataset
+    path = download_kaggle_dataset(KAGGLE_DATASET, KAGGLE_DATA_FILE)
+    print("")
 
-print("Step 5. Read the CSV file into a Pandas DataFrame")
-# Read the CSV file into a Pandas DataFrame
-df = read_csv_to_dataframe(path)
-print("")
 
+    print("Step 5. Read the CSV file into a Pandas DataFrame")
+    # Read the CSV file into a Pandas DataFrame
+    df = read_csv_to_dataframe(path)
+    print("")
 
-print("Step 6. Get the column names from the dataset - we need them to specify the object properties for the Weaviate collection and to generate the vector")
-# We need a list of the column names from the dataset
-# These column names are used to specify the object properties when inserting into Weaviate
-# and to generate the vector for each row
-# We need to exclude the label column from the list of column names
-value_column_names = get_dataframe_value_column_names_as_list(df, DATASET_LABEL_COLUMN)
-print("")
+
+    print("Step 6. Get the column names from the dataset - we need them to specify the object properties for the Weaviate collection and to generate the vector")
+    # We need a list of the column names from the dataset
+    # These column names are used to specify the object properties when inserting into Weaviate
+    # and to generate the vector for each row
+    # We need to exclude the label column from the list of column names
+    value_column_names = get_dataframe_value_column_names(df, DATASET_LABEL_COLUMN)
+
+    # Extract the values for the vectors once, as a NumPy array shared by all later steps
+    value_matrix = get_dataframe_value_matrix(df, value_column_names)
+
+    # Calculate the range of values for each column once, this is used to normalize the vectors
+    # (if specified) and to generate a random vector in steps 13 & 14
+    print("Calculate value ranges for each column in the dataset")
+    value_mins, value_maxs = column_min_max(value_matrix)
+
+    # The vectors are either the values themselves, or the values scaled to 0 to 1 if normalize has been specified
+    # Search vectors must be scaled in the same way as the stored vectors
+    if NORMALIZE_VECTORS:
+        print("Normalize vector values to the range 0 to 1 for each column")
+        vector_matrix = normalize_value_matrix(value_matrix, value_mins, value_maxs)
+    else:
+        vector_matrix = value_matrix
+    print("")
+except BaseException:
+    weaviate_close_client_when_connected(weaviate_connect_future)
+    raise
 
 
 # Perform all Weaviate operations within a try block since we need to
 # close the Weaviate client at the end, regardless of whether an exception is raised
+weaviate_client = None
 try:
-    print("Step 7. Connect to Weaviate")
-    weaviate_client = weaviate_connect()
+    print("Step 7. Connect to Weaviate - connection was started in step 4")
+    print("Weaviate must be running locally")
+    print(f"Connect to Weaviate (HTTP port {WEAVIATE_HTTP_PORT}, gRPC port {WEAVIATE_GRPC_PORT})")
+    weaviate_client = weaviate_connect_future.result()
+    print(f"Weaviate client is connected? {weaviate_client.is_connected()}")
     print(f"Weaviate client is ready? {weaviate_client.is_ready()}\n")  # Should print: `True`
 
 
@@ -397,20 +657,20 @@ try:
 
     print("Step 10. Insert the Pandas DataFrame into the Weaviate collection")
     # Insert the dataset into Weaviate
-    weaviate_insert_dataframe(collection, df, value_column_names)
+    weaviate_insert_dataframe(weaviate_client, WEAVIATE_COLLECTION, df, vector_matrix, WEAVIATE_BATCH_SIZE)
 
 
     print("Step 11. Count the number of rows in the original dataset and Weaviate collection as a sanity check - not if append has been specified (as prev-existing rows may have been present)")
-    # Count the number of rows in the original dataset and in the Weaviate collection
+    # Count the number of rows in the original dataset
     dataset_row_count = count_dataframe_items(df)
-    weaviate_collection_count = weaviate_count_collection_objects(collection)
-
     print(f"Number of rows in original dataset: {dataset_row_count}")
-    print(f"Number of rows in Weaviate collection: {weaviate_collection_count}")
 
-    # If the collection as been created from scratch, we can perform a sanity check,
-    # otherwise just output row totals
+    # If the collection as been created from scratch, we can count the objects in the Weaviate
+    # collection and perform a sanity check, otherwise skip counting (it scans the whole collection)
     if create_collection:
+        weaviate_collection_count = weaviate_count_collection_objects(collection)
+        print(f"Number of rows in Weaviate collection: {weaviate_collection_count}")
+
         if dataset_row_count == weaviate_collection_count:
             print("Number of rows in original dataset matches number of objects in Weaviate collection")
         else:
@@ -418,34 +678,34 @@ try:
     print("")
 
 
-    print("Step 12. Sanity check - query Weaviate using nearest vector search with a known sample row from the dataset")
-    # Sanity check - query Weaviate using a vector search with data from the
-    # CSV dataset and compare returned label value with expected label value
-    print("Query Weaviate with known sample row from dataset")
-
-    # Get vector and label for a random row from the dataset
-    test_vector, test_expected_label = get_random_vector_label_pair_from_dataframe(df, value_column_names, DATASET_LABEL_COLUMN)
+    print("Step 12. Sanity check - query Weaviate using nearest vector search with a sample of known rows from the dataset")
+    # Sanity check - query Weaviate using vector searches with data from the
+    # CSV dataset and compare returned label values with expected label values
+    # Get vectors and labels for a sample of random rows from the dataset
+    # (the sample is smaller than requested if the dataset has fewer rows)
+    test_vectors, test_expected_labels = get_random_vector_label_pairs_from_dataframe(df, vector_matrix, DATASET_LABEL_COLUMN, VERIFY_SAMPLE_SIZE)
+    print(f"Query Weaviate with {len(test_vectors)} known sample rows from dataset")
 
-    # Perform Weeaviate vector search and Verify that the result matches the expected label
-    verify_vector_search_label_matches(collection, test_vector, test_expected_label, DATASET_LABEL_COLUMN)
+    # Perform Weaviate vector searches and verify how many results match the expected labels
+    verify_vector_search_labels_batch(collection, test_vectors, test_expected_labels, DATASET_LABEL_COLUMN)
     print("")
 
 
     # Test querying Weaviate by nearest vector search with a random set of values
     # to get a recommendaed label value for a test vector value
 
-    print("Step 13. Calculate the range of values for each column in the original dataset - we need this so we can generate a random vector that has values within the range for each column")
-    # Calculate the range of values for each column, excluding label
-    dataset_value_ranges = get_dataframe_column_ranges(df, value_column_names)
-
-
-    print("Step 14. Generate a random vector from the range of values for each column")
-    # Generate a random vector from the range of values for each column
-    random_vector = generate_random_vector_from_property_ranges(dataset_value_ranges)
+    print("Step 13 & 14. Generate a random vector that has values within the range for each column in the original dataset (ranges calculated in step 6)")
+    # Generate a random vector from the range of values for each column, excluding label
+    random_vector = generate_random_vector_from_value_ranges(df, value_column_names, value_mins, value_maxs)
 
 
     print("Step 15. Test query - generate a random vector and query Weaviate with nearest vector search to obtain a recommended label value")
-    row, obtained_label, vector_distance = perform_vector_search(collection, random_vector, DATASET_LABEL_COLUMN)    
+    random_search_vector = random_vector
+    if NORMALIZE_VECTORS:
+        # Scale the random vector in the same way as the stored vectors
+        random_search_vector = normalize_value_matrix(np.array([random_vector], dtype=np.float32), value_mins, value_maxs)[0].tolist()
+
+    row, obtained_label, vector_distance = perform_vector_search(collection, random_search_vector, DATASET_LABEL_COLUMN)    
 
     print(f"Label obtained from nearest vector search from Weaviate with random vector values: {obtained_label}")
     print(f"Vector distance between random vector values and matched vector: {vector_distance}")
@@ -455,7 +715,8 @@ except Exception as e:
 finally:
     print("Final Step. We always need to close the Weaviate client, otherwise there is a risk of memory leaks")
     # We always need to close the Weaviate client, otherwise there is a risk of memory leaks
-    weaviate_close_client(weaviate_client)
+    if weaviate_client is not None:
+        weaviate_close_client(weaviate_client)
 
 print("")
 print("Done\n")